@@ -6,38 +6,75 @@
 """
 
 import os
+import shutil
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import json
 
-def download_file(url, local_path, chunk_size=8192):
-    """下载文件"""
+def download_file(session, url, local_path, chunk_size=1 << 18):
+    """下载文件（复用 session 的连接池，ETag 缓存避免重复下载）"""
     print(f"📥 下载: {url}")
+    etag_path = Path(f"{local_path}.etag")
     try:
-        response = requests.get(url, stream=True, timeout=30)
+        # 本地已有文件时发条件请求：远端未变化就不重新下载 90MB 权重
+        headers = {}
+        if local_path.exists() and etag_path.exists():
+            headers['If-None-Match'] = etag_path.read_text().strip()
+
+        response = session.get(url, stream=True, timeout=30, headers=headers)
+        if response.status_code == 304:
+            print(f"⏭️  远端未变化，复用本地文件: {local_path}")
+            return True
         response.raise_for_status()
-        
+
         local_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        with open(local_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                f.write(chunk)
-        
+
+        # 先写临时文件，校验大小后原子替换，避免留下截断的半成品
+        tmp_path = Path(f"{local_path}.tmp")
+        response.raw.decode_content = True
+        with open(tmp_path, 'wb', buffering=1 << 20) as f:
+            shutil.copyfileobj(response.raw, f, length=chunk_size)
+
+        expected = response.headers.get('Content-Length')
+        if (expected is not None
+                and 'Content-Encoding' not in response.headers
+                and tmp_path.stat().st_size != int(expected)):
+            print(f"❌ 下载不完整: {local_path} "
+                  f"({tmp_path.stat().st_size}/{expected} 字节)")
+            tmp_path.unlink()
+            return False
+
+        os.replace(tmp_path, local_path)
+
+        etag = response.headers.get('ETag')
+        if etag:
+            etag_path.write_text(etag)
+
         print(f"✅ 下载完成: {local_path}")
         return True
     except Exception as e:
         print(f"❌ 下载失败: {e}")
         return False
 
-def download_minilm_model():
-    """下载 all-MiniLM-L6-v2 模型"""
-    
-    # 镜像源 URLs
-    base_urls = [
-        "https://hf-mirror.com/sentence-transformers/all-MiniLM-L6-v2/resolve/main",
-        "https://huggingface.co/sentence-transformers/all-MiniLM-L6-v2/resolve/main"
-    ]
-    
+def download_minilm_model(mirrors=None):
+    """下载 all-MiniLM-L6-v2 模型
+
+    Args:
+        mirrors (list, optional): 按延迟排序的镜像域名列表
+    """
+
+    # 镜像源 URLs（默认顺序，main() 会传入按延迟排序的列表）
+    if mirrors:
+        base_urls = [f"{m}/sentence-transformers/all-MiniLM-L6-v2/resolve/main"
+                     for m in mirrors]
+    else:
+        base_urls = [
+            "https://hf-mirror.com/sentence-transformers/all-MiniLM-L6-v2/resolve/main",
+            "https://huggingface.co/sentence-transformers/all-MiniLM-L6-v2/resolve/main"
+        ]
+
     # 需要下载的文件
     files_to_download = [
         "config.json",
@@ -51,38 +88,32 @@ def download_minilm_model():
     
     # 本地存储路径
     model_dir = Path("./models/all-MiniLM-L6-v2")
-    
+
     print("🚀 开始下载 all-MiniLM-L6-v2 模型...")
     print(f"📁 保存到: {model_dir.absolute()}")
-    
-    success_count = 0
-    
-    for base_url in base_urls:
-        print(f"\n🌐 尝试镜像源: {base_url}")
-        
-        for file_name in files_to_download:
-            if file_name == "1_Pooling/config.json":
-                url = f"{base_url}/1_Pooling/config.json"
-                local_path = model_dir / "1_Pooling" / "config.json"
-            else:
-                url = f"{base_url}/{file_name}"
-                local_path = model_dir / file_name
-            
-            # 如果文件已存在，跳过
-            if local_path.exists():
-                print(f"⏭️  跳过已存在文件: {local_path}")
-                success_count += 1
-                continue
-            
-            if download_file(url, local_path):
-                success_count += 1
-            else:
-                print(f"❌ 文件下载失败: {file_name}")
-        
-        # 如果所有文件都下载成功，跳出循环
-        if success_count == len(files_to_download):
-            break
-    
+
+    # 共享 session：连接池 + keep-alive，省掉每个文件的 TLS 握手
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=8))
+
+    def fetch(file_name):
+        """下载单个文件：按延迟顺序逐个镜像尝试，成功即停
+
+        已存在的文件不再直接跳过，而是交给 download_file 做 ETag
+        条件请求校验——截断或过期的文件会被重新下载。
+        """
+        local_path = model_dir / file_name
+
+        for base_url in base_urls:
+            if download_file(session, f"{base_url}/{file_name}", local_path):
+                return True
+        print(f"❌ 文件下载失败: {file_name}")
+        return False
+
+    # 并发下载：各文件互相独立，总耗时 ≈ 最慢的单个文件
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        success_count = sum(executor.map(fetch, files_to_download))
+
     print(f"\n📊 下载统计: {success_count}/{len(files_to_download)} 文件成功")
     
     if success_count == len(files_to_download):
@@ -111,19 +142,24 @@ def main():
     available_mirrors = []
     for url in test_urls:
         try:
-            response = requests.get(url, timeout=10)
+            # HEAD 请求只测延迟，不下载页面内容
+            response = requests.head(url, timeout=3, allow_redirects=True)
             if response.status_code == 200:
-                available_mirrors.append(url)
-                print(f"✅ {url} 可访问")
+                latency = response.elapsed.total_seconds()
+                available_mirrors.append((latency, url))
+                print(f"✅ {url} 可访问 ({latency * 1000:.0f} ms)")
         except:
             print(f"❌ {url} 无法访问")
-    
+
     if not available_mirrors:
         print("❌ 无法访问任何镜像源，请检查网络连接")
         return False
-    
+
+    # 按延迟排序，优先用最快的镜像源
+    available_mirrors.sort()
+
     # 下载模型
-    return download_minilm_model()
+    return download_minilm_model(mirrors=[url for _, url in available_mirrors])
 
 if __name__ == "__main__":
     success = main()
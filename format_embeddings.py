@@ -5,95 +5,128 @@ Embedding JSON 格式化工具
 提供多种可读性选项
 """
 
+import base64
 import json
 import os
 
-def format_embeddings_compact(data):
-    """紧凑格式：embedding在一行内"""
-    result = []
-    for item in data:
-        formatted_item = {
+import numpy as np
+
+try:
+    import ijson
+    HAS_IJSON = True
+except ImportError:
+    HAS_IJSON = False
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+def iter_items(f):
+    """逐条迭代JSON数组元素
+
+    有ijson时流式解析，峰值内存只有单条数据大小；
+    否则退回json.load整体读入。
+    """
+    if HAS_IJSON:
+        # use_float=True：否则ijson把浮点数解析成Decimal，json/orjson都没法序列化
+        yield from ijson.items(f, 'item', use_float=True)
+    else:
+        yield from json.load(f)
+
+def format_embedding_compact(item):
+    """单条紧凑格式：embedding在一行内"""
+    return {
+        "prompt": item["prompt"],
+        "embedding": item["embedding"],  # 保持为数组，但会在一行内
+        "params": item["params"]
+    }
+
+def format_embedding_truncated(item, show_dims=10):
+    """单条截断格式：只显示前几维和后几维"""
+    embedding = item["embedding"]
+    if len(embedding) > show_dims * 2:
+        # 显示前几维 + "..." + 后几维
+        truncated = (embedding[:show_dims] +
+                    [f"... {len(embedding) - show_dims*2} more ..."] +
+                    embedding[-show_dims:])
+        return {
             "prompt": item["prompt"],
-            "embedding": item["embedding"],  # 保持为数组，但会在一行内
+            "embedding_preview": truncated,
+            "embedding_full": f"[{len(embedding)} dimensions - use programmatically]",
+            "embedding": item["embedding"],  # 完整数据保留
             "params": item["params"]
         }
-        result.append(formatted_item)
+    return item.copy()
+
+def format_embedding_summary(item, include_full=False):
+    """单条摘要格式：用统计信息替代完整数组
+
+    include_full=True 时额外保留完整embedding；默认不保留——
+    完整数据在原始文件和紧凑格式里都有，摘要文件没必要再付一份磁盘。
+    """
+    embedding = item["embedding"]
+    arr = np.asarray(embedding)
+
+    # 计算统计信息（numpy一次归约，代替Python级的sum/min/max循环）
+    stats = {
+        "dimensions": int(arr.size),
+        "mean": round(float(arr.mean()), 6),
+        "min": round(float(arr.min()), 6),
+        "max": round(float(arr.max()), 6),
+        "first_5": np.round(arr[:5], 6).tolist(),
+        "last_5": np.round(arr[-5:], 6).tolist()
+    }
+
+    result = {
+        "prompt": item["prompt"],
+        "embedding_stats": stats,
+        "params": item["params"]
+    }
+    if include_full:
+        result["embedding"] = item["embedding"]
     return result
 
+def format_embeddings_compact(data):
+    """紧凑格式：embedding在一行内"""
+    return [format_embedding_compact(item) for item in data]
+
 def format_embeddings_truncated(data, show_dims=10):
     """截断格式：只显示前几维和后几维"""
-    result = []
-    for item in data:
-        embedding = item["embedding"]
-        if len(embedding) > show_dims * 2:
-            # 显示前几维 + "..." + 后几维
-            truncated = (embedding[:show_dims] + 
-                        [f"... {len(embedding) - show_dims*2} more ..."] + 
-                        embedding[-show_dims:])
-            formatted_item = {
-                "prompt": item["prompt"],
-                "embedding_preview": truncated,
-                "embedding_full": f"[{len(embedding)} dimensions - use programmatically]",
-                "embedding": item["embedding"],  # 完整数据保留
-                "params": item["params"]
-            }
-        else:
-            formatted_item = item.copy()
-        result.append(formatted_item)
-    return result
+    return [format_embedding_truncated(item, show_dims) for item in data]
 
-def format_embeddings_summary(data):
+def format_embeddings_summary(data, include_full=False):
     """摘要格式：用统计信息替代完整数组"""
-    result = []
-    for item in data:
-        embedding = item["embedding"]
-        
-        # 计算统计信息
-        stats = {
-            "dimensions": len(embedding),
-            "mean": round(sum(embedding) / len(embedding), 6),
-            "min": round(min(embedding), 6),
-            "max": round(max(embedding), 6),
-            "first_5": [round(x, 6) for x in embedding[:5]],
-            "last_5": [round(x, 6) for x in embedding[-5:]]
-        }
-        
-        formatted_item = {
-            "prompt": item["prompt"],
-            "embedding_stats": stats,
-            "embedding": item["embedding"],  # 完整数据保留
-            "params": item["params"]
-        }
-        result.append(formatted_item)
-    return result
+    return [format_embedding_summary(item, include_full) for item in data]
 
-def save_formatted_json(data, output_file, format_type="compact"):
-    """保存格式化的JSON"""
-    
-    if format_type == "compact":
-        formatted_data = format_embeddings_compact(data)
-        # 自定义JSON编码器，让embedding数组紧凑显示
-        json_str = json.dumps(formatted_data, ensure_ascii=False, indent=2)
-        
-    elif format_type == "truncated":
-        formatted_data = format_embeddings_truncated(data, show_dims=5)
-        json_str = json.dumps(formatted_data, ensure_ascii=False, indent=2)
-        
-    elif format_type == "summary":
-        formatted_data = format_embeddings_summary(data)
-        json_str = json.dumps(formatted_data, ensure_ascii=False, indent=2)
-        
-    else:  # default
-        json_str = json.dumps(data, ensure_ascii=False, indent=2)
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(json_str)
-    
-    return formatted_data
+def quantize_embedding(embedding):
+    """单行int8量化：L2归一化后取绝对值最大值做scale
+
+    前端用 emb = q * scale 反量化，余弦相似度约保留3位小数，
+    载荷比FP32小约4倍；scale纯粹按行计算，所以可以在主循环里
+    逐行量化，保持流式单遍处理。
+    """
+    arr = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(arr))
+    if norm > 0:
+        arr = arr / norm
+    scale = float(np.abs(arr).max()) / 127.0 if arr.size else 0.0
+    if scale == 0:
+        scale = 1.0
+    q = np.round(arr / scale).astype(np.int8)
+    return q, scale
+
+def dump_item(obj):
+    """序列化单条记录（有orjson走C实现的浮点格式化）"""
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, indent=2)
 
 def main():
     """主函数"""
     INPUT_FILE = 'public/all_prompts_results_with_embeddings.json'
+    QUANTIZED_FILE = 'public/embeddings_quantized.json'
     
     # 检查输入文件
     if not os.path.exists(INPUT_FILE):
@@ -101,48 +134,102 @@ def main():
         print("请先运行 generate_embeddings_offline.py")
         return
     
-    # 读取数据
-    print(f"📖 Reading data from: {INPUT_FILE}")
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    print(f"📝 Found {len(data)} prompts")
-    
     # 生成不同格式的文件
     formats = {
         "compact": {
             "file": "public/embeddings_compact.json",
-            "desc": "紧凑格式 - embedding在一行内"
+            "desc": "紧凑格式 - embedding在一行内",
+            "format_item": format_embedding_compact
         },
         "truncated": {
-            "file": "public/embeddings_readable.json", 
-            "desc": "可读格式 - 只显示部分embedding"
+            "file": "public/embeddings_readable.json",
+            "desc": "可读格式 - 只显示部分embedding",
+            "format_item": lambda item: format_embedding_truncated(item, show_dims=5)
         },
         "summary": {
             "file": "public/embeddings_summary.json",
-            "desc": "摘要格式 - 用统计信息代替"
+            "desc": "摘要格式 - 用统计信息代替",
+            "format_item": format_embedding_summary
         }
     }
-    
+
+    # 流式单遍处理：逐条解析输入，三种格式同时增量写出，
+    # 既不在内存里保留原始数据，也不保留格式化后的列表；
+    # 量化输出也逐行累积，只留int8字节和每行一个scale
+    print(f"📖 Reading data from: {INPUT_FILE}")
     print("\n🎨 生成不同格式的文件...")
-    
-    for format_name, config in formats.items():
+    for config in formats.values():
         print(f"🔄 生成 {config['desc']}...")
-        
+
+    count = 0
+    sample_stats = None
+    prompts = []
+    q_chunks = []
+    scales = []
+    dim = 0
+    outputs = {}
+    try:
+        # 先写 .tmp，全部成功后再原子替换，中途失败不会截断已有输出
+        outputs = {name: open(f"{config['file']}.tmp", 'w', encoding='utf-8',
+                              buffering=1 << 20)
+                   for name, config in formats.items()}
+        with open(INPUT_FILE, 'rb') as f:
+            for item in iter_items(f):
+                prefix = '[\n' if count == 0 else ',\n'
+                for name, out in outputs.items():
+                    out.write(prefix)
+                    out.write(dump_item(formats[name]['format_item'](item)))
+                if sample_stats is None:
+                    sample_stats = format_embedding_summary(item)['embedding_stats']
+                prompts.append(item["prompt"])
+                q_row, scale = quantize_embedding(item["embedding"])
+                q_chunks.append(q_row.tobytes())
+                scales.append(scale)
+                dim = q_row.size
+                count += 1
+
+        for out in outputs.values():
+            out.write('\n]\n' if count else '[]\n')
+            out.close()
+
+        for config in formats.values():
+            os.replace(f"{config['file']}.tmp", config['file'])
+    except Exception as e:
+        print(f"❌ 生成失败: {e}")
+        for out in outputs.values():
+            out.close()
+        for config in formats.values():
+            if os.path.exists(f"{config['file']}.tmp"):
+                os.remove(f"{config['file']}.tmp")
+        return
+
+    print(f"📝 Found {count} prompts")
+
+    for config in formats.values():
+        file_size = os.path.getsize(config['file']) / 1024
+        print(f"✅ {config['file']} ({file_size:.1f} KB)")
+
+    # int8量化格式：完整矩阵以base64字节串存储，体积约为FP32 JSON的1/4
+    if count:
+        print(f"🔄 生成 量化格式 - int8矩阵+每行scale...")
         try:
-            formatted_data = save_formatted_json(data, config['file'], format_name)
-            file_size = os.path.getsize(config['file']) / 1024
-            
-            print(f"✅ {config['file']} ({file_size:.1f} KB)")
-            
-            # 显示第一个示例
-            if format_name == "summary":
-                sample = formatted_data[0]
-                print(f"   示例统计: {sample['embedding_stats']['dimensions']}维, "
-                      f"均值={sample['embedding_stats']['mean']}")
-            
+            payload = {
+                "shape": [count, dim],
+                "scales": np.round(np.asarray(scales), 8).tolist(),
+                "q": base64.b64encode(b''.join(q_chunks)).decode('ascii'),
+                "prompts": prompts
+            }
+            with open(QUANTIZED_FILE, 'w', encoding='utf-8') as f:
+                f.write(dump_item(payload))
+            file_size = os.path.getsize(QUANTIZED_FILE) / 1024
+            print(f"✅ {QUANTIZED_FILE} ({file_size:.1f} KB)")
         except Exception as e:
             print(f"❌ 生成失败: {e}")
+
+    # 显示第一个示例
+    if sample_stats is not None:
+        print(f"   示例统计: {sample_stats['dimensions']}维, "
+              f"均值={sample_stats['mean']}")
     
     print(f"\n📋 原始文件大小: {os.path.getsize(INPUT_FILE) / 1024:.1f} KB")
     print("\n💡 使用建议:")
@@ -8,13 +8,41 @@ SwarmChemistry Prompt Embedding Generator
 pip install sentence-transformers numpy scikit-learn
 """
 
+import hashlib
 import json
 import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 from sklearn.decomposition import PCA
 import os
 import time
 
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+try:
+    import zstandard as zstd
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+def compress_zstd(path, level=9):
+    """生成 path.zst 压缩副本用于分发（浮点文本可压约3-5倍）"""
+    if not HAS_ZSTD:
+        return None
+    zst_path = f"{path}.zst"
+    cctx = zstd.ZstdCompressor(level=level)
+    with open(path, 'rb') as fin, open(zst_path, 'wb') as fout:
+        cctx.copy_stream(fin, fout)
+    return zst_path
+
+# 编码结果磁盘缓存：重复运行时未变化的prompt直接复用，不再过模型
+CACHE_FILE = 'embedding_cache.npy'
+CACHE_KEYS_FILE = 'embedding_cache_keys.txt'
+
 class PromptEmbeddingGenerator:
     def __init__(self, model_name='all-MiniLM-L6-v2', reduce_dim=None):
         """
@@ -25,13 +53,147 @@ class PromptEmbeddingGenerator:
             reduce_dim (int, optional): 如果指定，使用PCA降维到指定维度
         """
         print(f"🚀 Loading model: {model_name}")
-        self.model = SentenceTransformer(model_name)
+        self.model = self._load_model(model_name)
+        # prompt都很短，限制最大序列长度避免极端输入拖慢整个batch
+        self.model.max_seq_length = 128
         self.reduce_dim = reduce_dim
         self.pca = None
         
         print(f"✅ Model loaded successfully")
         print(f"📊 Original embedding dimension: {self.model.get_sentence_embedding_dimension()}")
-        
+
+    @staticmethod
+    def _load_model(model_name):
+        """加载模型，CPU推理优先尝试ONNX Runtime后端
+
+        ONNX Runtime做了图融合，CPU上比PyTorch eager快约2-3倍；
+        需要 sentence-transformers>=3 和 optimum[onnxruntime]，
+        不可用时回退到默认PyTorch后端。
+        """
+        if not torch.cuda.is_available():
+            try:
+                model = SentenceTransformer(model_name, backend='onnx')
+                print("⚡ Using ONNX Runtime backend for CPU inference")
+                return model
+            except Exception as e:
+                print(f"⚠️ ONNX backend unavailable ({e}), falling back to PyTorch")
+        return SentenceTransformer(model_name)
+
+    def _token_lengths(self, prompts):
+        """统计每条prompt的token数，用于编码前按长度排序
+
+        用Rust fast tokenizer一次批量tokenize；tokenizer不可用时
+        退回字符长度近似。
+        """
+        tokenizer = getattr(self.model, 'tokenizer', None)
+        if tokenizer is None:
+            return [len(p) for p in prompts]
+        if not getattr(tokenizer, 'is_fast', True):
+            print("⚠️ Slow Python tokenizer in use; install 'tokenizers' for the fast one")
+        encoded = tokenizer(list(prompts), truncation=True, max_length=128)
+        return [len(ids) for ids in encoded['input_ids']]
+
+    @staticmethod
+    def _prompt_key(prompt):
+        """prompt的缓存键（blake2b摘要）"""
+        return hashlib.blake2b(prompt.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _encode_unique(self, unique_prompts):
+        """编码去重后的prompt列表，带磁盘缓存
+
+        缓存矩阵以mmap方式打开，命中的行由内核页缓存直接供给，
+        只有未命中的prompt才真正过模型；全命中时一次GPU调用都没有。
+        """
+        keys = [self._prompt_key(p) for p in unique_prompts]
+
+        # 读缓存：mmap打开，不把整个缓存矩阵读进内存
+        cached_rows = {}
+        cache_index = {}
+        if os.path.exists(CACHE_FILE) and os.path.exists(CACHE_KEYS_FILE):
+            cache = np.load(CACHE_FILE, mmap_mode='r')
+            # 维度校验：换了模型的旧缓存按全部未命中处理，否则命中行
+            # 会以错误维度混进输出；重建交给_append_cache的已有逻辑
+            get_dim = getattr(self.model, 'get_sentence_embedding_dimension', None)
+            expected_dim = get_dim() if get_dim is not None else None
+            if cache.ndim != 2 or (expected_dim is not None
+                                   and cache.shape[1] != expected_dim):
+                print("⚠️ 缓存维度不匹配（可能换了模型），本次不使用缓存")
+            else:
+                with open(CACHE_KEYS_FILE, 'r', encoding='utf-8') as f:
+                    cache_index = {key: row for row, key in enumerate(f.read().split())}
+                for pos, key in enumerate(keys):
+                    row = cache_index.get(key)
+                    if row is not None and row < cache.shape[0]:
+                        cached_rows[pos] = np.asarray(cache[row], dtype=np.float32)
+                if cached_rows:
+                    print(f"♻️  Embedding cache hits: {len(cached_rows)}/{len(keys)}")
+
+        miss_positions = [pos for pos in range(len(keys)) if pos not in cached_rows]
+        if miss_positions:
+            miss_prompts = [unique_prompts[pos] for pos in miss_positions]
+
+            # 按token数排序，减少每个batch内的padding浪费；编码后恢复原顺序
+            order = np.argsort(self._token_lengths(miss_prompts), kind='stable')
+            sorted_prompts = [miss_prompts[i] for i in order]
+
+            # 生成原始embeddings（大batch摊薄每次调用的开销）
+            miss_embeddings = self.model.encode(
+                sorted_prompts,
+                batch_size=256,
+                show_progress_bar=True,
+                convert_to_numpy=True,
+                device='cuda' if torch.cuda.is_available() else 'cpu'
+            )
+            miss_embeddings = miss_embeddings[np.argsort(order)]
+        else:
+            miss_embeddings = None
+
+        # 组装输出矩阵
+        dim = (miss_embeddings.shape[1] if miss_embeddings is not None
+               else next(iter(cached_rows.values())).shape[0])
+        embeddings = np.empty((len(keys), dim), dtype=np.float32)
+        for pos, row in cached_rows.items():
+            embeddings[pos] = row
+        for j, pos in enumerate(miss_positions):
+            embeddings[pos] = miss_embeddings[j]
+
+        if miss_positions:
+            self._append_cache(cache_index, keys, miss_positions, embeddings)
+
+        return embeddings
+
+    @staticmethod
+    def _append_cache(cache_index, keys, miss_positions, embeddings):
+        """把新编码的行追加到磁盘缓存
+
+        .npy无法原地追加，这里整体重写；缓存维度变化（换了模型）时重建。
+        """
+        seen = set(cache_index)
+        new_keys = []
+        new_rows = []
+        for pos in miss_positions:
+            if keys[pos] in seen:
+                continue
+            seen.add(keys[pos])
+            new_keys.append(keys[pos])
+            new_rows.append(embeddings[pos])
+        if not new_rows:
+            return
+
+        new_rows = np.asarray(new_rows, dtype=np.float32)
+        all_keys = sorted(cache_index, key=cache_index.get) + new_keys
+        if os.path.exists(CACHE_FILE) and cache_index:
+            old = np.load(CACHE_FILE, mmap_mode='r')
+            if old.ndim == 2 and old.shape[1] == new_rows.shape[1]:
+                new_rows = np.vstack([old, new_rows])
+            else:
+                print("⚠️ 缓存维度不匹配（可能换了模型），重建缓存")
+                all_keys = new_keys
+
+        np.save(CACHE_FILE, new_rows)
+        with open(CACHE_KEYS_FILE, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(all_keys) + '\n')
+
     def generate_embeddings(self, prompts):
         """
         为prompt列表生成embedding向量
@@ -43,10 +205,18 @@ class PromptEmbeddingGenerator:
             numpy.ndarray: embedding矩阵
         """
         print(f"🔄 Generating embeddings for {len(prompts)} prompts...")
-        
-        # 生成原始embeddings
-        embeddings = self.model.encode(prompts, show_progress_bar=True)
-        
+
+        # 去重：重复prompt只编码一次，成本随不同prompt数而非总条数增长
+        unique, inverse = np.unique(np.asarray(prompts, dtype=object),
+                                    return_inverse=True)
+        unique_prompts = unique.tolist()
+        if len(unique_prompts) < len(prompts):
+            print(f"♻️  Deduplicated: {len(prompts)} -> {len(unique_prompts)} prompts")
+
+        # 编码去重后的prompt（带磁盘缓存），再按inverse索引展开回每条输入
+        unique_embeddings = self._encode_unique(unique_prompts)
+        embeddings = unique_embeddings[inverse]
+
         # 可选：降维处理
         if self.reduce_dim and self.reduce_dim < embeddings.shape[1]:
             print(f"🔧 Reducing dimensions from {embeddings.shape[1]} to {self.reduce_dim}")
@@ -91,20 +261,43 @@ class PromptEmbeddingGenerator:
         
         # 更新数据结构
         print("🔄 Updating data structure...")
+        # 一次性向量化处理：四舍五入到6位小数以减少文件大小
+        # （必须在float64下round：float32的0.039229转成Python float会带
+        # 十几位尾数，序列化后体积反而翻倍）
+        rows = np.round(embeddings.astype(np.float64), 6).tolist()
         for i, item in enumerate(data):
-            # 将numpy数组转换为Python列表，保留合理的精度
-            embedding_list = embeddings[i].astype(np.float32).tolist()
-            # 四舍五入到6位小数以减少文件大小
-            embedding_list = [round(x, 6) for x in embedding_list]
-            item['embedding'] = embedding_list
-            
+            item['embedding'] = rows[i]
+            # 对应二进制sidecar中的行号，前端可按索引直接读取
+            item['embedding_index'] = i
+
         # 保存结果
         output_path = output_file or input_file
         print(f"💾 Saving updated data to: {output_path}")
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            
+
+        # 二进制sidecar：FP16每个值4字节变2字节，体积约为JSON文本的1/6，
+        # 且前端读取热数据时无需解析JSON
+        sidecar_base = os.path.splitext(output_path)[0]
+        fp16 = embeddings.astype(np.float16)
+        np.save(f"{sidecar_base}_embeddings.npy", fp16)
+        fp16.tofile(f"{sidecar_base}_embeddings.f16")
+        print(f"💾 Binary sidecars: {sidecar_base}_embeddings.npy / .f16")
+
+        if HAS_ORJSON:
+            # orjson：C实现的浮点序列化，比stdlib json快5-10倍
+            with open(output_path, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        else:
+            # 先序列化成完整字符串，单次write写入，避免json.dump的大量小写入
+            json_str = json.dumps(data, ensure_ascii=False, indent=2)
+            with open(output_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+                f.write(json_str)
+
+        # zstd压缩副本：前端可用fzstd(wasm)解压，节省分发带宽
+        for original in (output_path, f"{sidecar_base}_embeddings.f16"):
+            zst_path = compress_zstd(original)
+            if zst_path:
+                print(f"🗜️  {zst_path} ({os.path.getsize(zst_path) / 1024:.1f} KB)")
+
         print(f"✅ Processing completed successfully!")
         print(f"📊 Statistics:")
         print(f"  - Total prompts: {len(prompts)}")